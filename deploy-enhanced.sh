@@ -27,6 +27,39 @@ else
     exit 1
 fi
 
+ADMISSION_TABLE="${ADMISSION_TABLE:-achamin-admission-control}"
+AGGREGATES_TABLE="${AGGREGATES_TABLE:-achamin-metadata-aggregates}"
+AGGREGATES_FUNCTION_NAME="${AGGREGATES_FUNCTION_NAME:-$PROJECT_NAME-metadata-aggregates}"
+PRECOMPUTE_FUNCTION_NAME="${PRECOMPUTE_FUNCTION_NAME:-$PROJECT_NAME-precompute}"
+AGGREGATES_DLQ_NAME="${AGGREGATES_DLQ_NAME:-$PROJECT_NAME-metadata-aggregates-dlq}"
+
+# Inline audio mixing runs ffmpeg, which the Lambda runtime only has through a layer
+LAYER_ARGS=()
+if [ -n "$FFMPEG_LAYER_ARN" ]; then
+    LAYER_ARGS=(--layers "$FFMPEG_LAYER_ARN")
+fi
+
+# Story model, profiling, admission, Polly engine, breaker and timeout settings
+# shared by every function that calls Bedrock or Polly
+SERVICE_ENV="STORY_MODEL_BACKEND=${STORY_MODEL_BACKEND:-completions},
+                STORY_MODEL_ID=${STORY_MODEL_ID:-anthropic.claude-instant-v1},
+                PROFILE_ENABLED=${PROFILE_ENABLED:-false},
+                PROFILE_SAMPLE_EVERY=${PROFILE_SAMPLE_EVERY:-0},
+                PROFILE_OUTPUT=${PROFILE_OUTPUT:-/tmp/achamin-profiles},
+                BEDROCK_RATE_LIMIT=${BEDROCK_RATE_LIMIT:-2},
+                BEDROCK_MAX_CONCURRENCY=${BEDROCK_MAX_CONCURRENCY:-10},
+                POLLY_RATE_LIMIT=${POLLY_RATE_LIMIT:-8},
+                POLLY_MAX_CONCURRENCY=${POLLY_MAX_CONCURRENCY:-20},
+                ADMISSION_DEADLINE_SECONDS=${ADMISSION_DEADLINE_SECONDS:-5},
+                POLLY_ENGINE=${POLLY_ENGINE:-neural},
+                BEDROCK_BREAKER_FAILURES=${BEDROCK_BREAKER_FAILURES:-3},
+                BEDROCK_BREAKER_RECOVERY_SECONDS=${BEDROCK_BREAKER_RECOVERY_SECONDS:-30},
+                POLLY_BREAKER_FAILURES=${POLLY_BREAKER_FAILURES:-5},
+                POLLY_BREAKER_RECOVERY_SECONDS=${POLLY_BREAKER_RECOVERY_SECONDS:-15},
+                BEDROCK_READ_TIMEOUT_SECONDS=${BEDROCK_READ_TIMEOUT_SECONDS:-30},
+                POLLY_READ_TIMEOUT_SECONDS=${POLLY_READ_TIMEOUT_SECONDS:-10},
+                STORY_CACHE_TTL_SECONDS=${STORY_CACHE_TTL_SECONDS:-604800}"
+
 # Function to print colored output
 print_status() {
     echo -e "${GREEN}[INFO]${NC} $1"
@@ -261,6 +294,22 @@ EOF
     fi
 }
 
+# Function to create the shared admission control table
+create_admission_table() {
+    print_status "Creating admission control table..."
+    
+    if aws dynamodb describe-table --table-name "$ADMISSION_TABLE" 2>/dev/null; then
+        print_warning "DynamoDB table $ADMISSION_TABLE already exists"
+    else
+        sed "s/achamin-admission-control/$ADMISSION_TABLE/" \
+            "$SCRIPT_DIR/infrastructure/admission-table-definition.json" > /tmp/admission-table-definition.json
+        aws dynamodb create-table --cli-input-json file:///tmp/admission-table-definition.json
+        rm -f /tmp/admission-table-definition.json
+        
+        print_status "Created DynamoDB table: $ADMISSION_TABLE"
+    fi
+}
+
 # Function to create IAM roles
 create_iam_roles() {
     print_status "Creating IAM roles..."
@@ -318,6 +367,10 @@ EOF
             --role-name achamin-lambda-role \
             --policy-arn arn:aws:iam::aws:policy/AWSStepFunctionsFullAccess
         
+        aws iam attach-role-policy \
+            --role-name achamin-lambda-role \
+            --policy-arn arn:aws:iam::aws:policy/AmazonSQSFullAccess
+        
         print_status "Created IAM role: achamin-lambda-role"
         
         # Wait for role to be available
@@ -345,19 +398,29 @@ create_lambda_function() {
     
     # Create deployment package
     mkdir -p package
-    cp enhanced_achamin_lambda.py package/
+    cp enhanced_achamin_lambda.py audio_mixer.py profiling.py admission.py circuit_breaker.py package/
     pip install -r <(pip freeze) -t package/ --no-deps
     
     cd package
     zip -r ../enhanced-lambda.zip .
     cd ..
     
+    if [ "${ENABLE_AUDIO_MIXING:-false}" = "true" ] && [ -z "$FFMPEG_LAYER_ARN" ]; then
+        print_warning "ENABLE_AUDIO_MIXING is set without FFMPEG_LAYER_ARN; audio will be served unmixed"
+    fi
+    
     # Deploy Lambda function
     if aws lambda get-function --function-name "$LAMBDA_FUNCTION_NAME" 2>/dev/null; then
         print_warning "Lambda function $LAMBDA_FUNCTION_NAME already exists, updating..."
         aws lambda update-function-code \
             --function-name "$LAMBDA_FUNCTION_NAME" \
             --zip-file fileb://enhanced-lambda.zip
+        if [ -n "$FFMPEG_LAYER_ARN" ]; then
+            aws lambda wait function-updated --function-name "$LAMBDA_FUNCTION_NAME"
+            aws lambda update-function-configuration \
+                --function-name "$LAMBDA_FUNCTION_NAME" \
+                "${LAYER_ARGS[@]}"
+        fi
     else
         aws lambda create-function \
             --function-name "$LAMBDA_FUNCTION_NAME" \
@@ -367,12 +430,17 @@ create_lambda_function() {
             --zip-file fileb://enhanced-lambda.zip \
             --timeout 300 \
             --memory-size 1024 \
+            "${LAYER_ARGS[@]}" \
             --environment Variables="{
                 UPLOAD_BUCKET=$UPLOAD_BUCKET,
                 GENERATED_CONTENT_BUCKET=$GENERATED_CONTENT_BUCKET,
                 MUSIC_BUCKET=$MUSIC_BUCKET,
                 METADATA_TABLE=$METADATA_TABLE,
-                ACHAMIN_REGION=$AWS_REGION
+                ACHAMIN_REGION=$AWS_REGION,
+                ENABLE_AUDIO_MIXING=${ENABLE_AUDIO_MIXING:-false},
+                ADMISSION_TABLE=$ADMISSION_TABLE,
+                ENABLE_STORY_CACHE=${ENABLE_STORY_CACHE:-false},
+                $SERVICE_ENV
             }"
         
         print_status "Created Lambda function: $LAMBDA_FUNCTION_NAME"
@@ -384,6 +452,75 @@ create_lambda_function() {
     cd "$SCRIPT_DIR"
 }
 
+# Function to deploy the metadata stream consumer and its aggregates table
+create_aggregates_consumer() {
+    print_status "Creating metadata aggregates consumer..."
+    
+    if aws dynamodb describe-table --table-name "$AGGREGATES_TABLE" 2>/dev/null; then
+        print_warning "DynamoDB table $AGGREGATES_TABLE already exists"
+    else
+        sed "s/achamin-metadata-aggregates/$AGGREGATES_TABLE/" \
+            "$SCRIPT_DIR/infrastructure/aggregates-table-definition.json" > /tmp/aggregates-table-definition.json
+        aws dynamodb create-table --cli-input-json file:///tmp/aggregates-table-definition.json
+        rm -f /tmp/aggregates-table-definition.json
+        aws dynamodb wait table-exists --table-name "$AGGREGATES_TABLE"
+        
+        # Expire the per-record dedup markers once the stream can no longer redeliver them
+        aws dynamodb update-time-to-live \
+            --table-name "$AGGREGATES_TABLE" \
+            --time-to-live-specification "Enabled=true,AttributeName=expires_at"
+        
+        print_status "Created DynamoDB table: $AGGREGATES_TABLE"
+    fi
+    
+    cd "$SCRIPT_DIR/lambdas"
+    zip -q aggregates-lambda.zip metadata_aggregates.py
+    
+    if aws lambda get-function --function-name "$AGGREGATES_FUNCTION_NAME" 2>/dev/null; then
+        print_warning "Lambda function $AGGREGATES_FUNCTION_NAME already exists, updating..."
+        aws lambda update-function-code \
+            --function-name "$AGGREGATES_FUNCTION_NAME" \
+            --zip-file fileb://aggregates-lambda.zip
+    else
+        aws lambda create-function \
+            --function-name "$AGGREGATES_FUNCTION_NAME" \
+            --runtime python3.9 \
+            --role "arn:aws:iam::$(aws sts get-caller-identity --query Account --output text):role/achamin-lambda-role" \
+            --handler metadata_aggregates.lambda_handler \
+            --zip-file fileb://aggregates-lambda.zip \
+            --timeout 60 \
+            --memory-size 256 \
+            --environment Variables="{AGGREGATES_TABLE=$AGGREGATES_TABLE}"
+        
+        STREAM_ARN=$(aws dynamodb describe-table --table-name "$METADATA_TABLE" \
+            --query Table.LatestStreamArn --output text)
+        
+        # Records that still fail after the retries go to a dead-letter queue
+        # instead of blocking the shard until they expire
+        DLQ_URL=$(aws sqs create-queue --queue-name "$AGGREGATES_DLQ_NAME" \
+            --attributes MessageRetentionPeriod=1209600 --query QueueUrl --output text)
+        DLQ_ARN=$(aws sqs get-queue-attributes --queue-url "$DLQ_URL" \
+            --attribute-names QueueArn --query Attributes.QueueArn --output text)
+        
+        aws lambda create-event-source-mapping \
+            --function-name "$AGGREGATES_FUNCTION_NAME" \
+            --event-source-arn "$STREAM_ARN" \
+            --starting-position LATEST \
+            --batch-size 100 \
+            --maximum-batching-window-in-seconds 5 \
+            --bisect-batch-on-function-error \
+            --function-response-types ReportBatchItemFailures \
+            --maximum-retry-attempts "${AGGREGATES_MAX_RETRY_ATTEMPTS:-5}" \
+            --maximum-record-age-in-seconds "${AGGREGATES_MAX_RECORD_AGE_SECONDS:-3600}" \
+            --destination-config "OnFailure={Destination=$DLQ_ARN}"
+        
+        print_status "Created Lambda function: $AGGREGATES_FUNCTION_NAME"
+    fi
+    
+    rm -f aggregates-lambda.zip
+    cd "$SCRIPT_DIR"
+}
+
 # Function to create API Gateway
 create_api_gateway() {
     print_status "Creating API Gateway..."
@@ -531,6 +668,112 @@ create_step_functions() {
     rm -f /tmp/workflow-definition.json
 }
 
+# Function to schedule warm-up pings for the Lambda function
+create_warmup_schedule() {
+    print_status "Creating warm-up schedule..."
+    
+    ACCOUNT_ID=$(aws sts get-caller-identity --query Account --output text)
+    LAMBDA_ARN="arn:aws:lambda:$AWS_REGION:$ACCOUNT_ID:function:$LAMBDA_FUNCTION_NAME"
+    
+    RULE_ARN=$(aws events put-rule \
+        --name "$PROJECT_NAME-warmup" \
+        --schedule-expression "${WARMUP_SCHEDULE:-rate(5 minutes)}" \
+        --query RuleArn --output text)
+    
+    aws lambda add-permission \
+        --function-name "$LAMBDA_FUNCTION_NAME" \
+        --statement-id "$PROJECT_NAME-warmup" \
+        --action lambda:InvokeFunction \
+        --principal events.amazonaws.com \
+        --source-arn "$RULE_ARN" 2>/dev/null || print_warning "Warm-up permission already exists"
+    
+    cat > /tmp/warmup-targets.json << EOF
+[
+    {
+        "Id": "warmup",
+        "Arn": "$LAMBDA_ARN",
+        "Input": "{\\"warmup\\": true}"
+    }
+]
+EOF
+    
+    aws events put-targets --rule "$PROJECT_NAME-warmup" --targets file:///tmp/warmup-targets.json
+    rm -f /tmp/warmup-targets.json
+    
+    print_status "Created warm-up schedule: $PROJECT_NAME-warmup"
+}
+
+# Function to deploy the cache precompute job and schedule it ahead of peak hours
+create_precompute_job() {
+    print_status "Creating cache precompute job..."
+    
+    cd "$SCRIPT_DIR/lambdas"
+    zip -q precompute-lambda.zip precompute_job.py enhanced_achamin_lambda.py audio_mixer.py \
+        profiling.py admission.py circuit_breaker.py metadata_aggregates.py
+    
+    ACCOUNT_ID=$(aws sts get-caller-identity --query Account --output text)
+    
+    if aws lambda get-function --function-name "$PRECOMPUTE_FUNCTION_NAME" 2>/dev/null; then
+        print_warning "Lambda function $PRECOMPUTE_FUNCTION_NAME already exists, updating..."
+        aws lambda update-function-code \
+            --function-name "$PRECOMPUTE_FUNCTION_NAME" \
+            --zip-file fileb://precompute-lambda.zip
+    else
+        aws lambda create-function \
+            --function-name "$PRECOMPUTE_FUNCTION_NAME" \
+            --runtime python3.9 \
+            --role "arn:aws:iam::$ACCOUNT_ID:role/achamin-lambda-role" \
+            --handler precompute_job.lambda_handler \
+            --zip-file fileb://precompute-lambda.zip \
+            --timeout 900 \
+            --memory-size 1024 \
+            "${LAYER_ARGS[@]}" \
+            --environment Variables="{
+                GENERATED_CONTENT_BUCKET=$GENERATED_CONTENT_BUCKET,
+                MUSIC_BUCKET=$MUSIC_BUCKET,
+                METADATA_TABLE=$METADATA_TABLE,
+                ACHAMIN_REGION=$AWS_REGION,
+                ENABLE_AUDIO_MIXING=${ENABLE_AUDIO_MIXING:-false},
+                ADMISSION_TABLE=$ADMISSION_TABLE,
+                AGGREGATES_TABLE=$AGGREGATES_TABLE,
+                PRECOMPUTE_MAX_WORKERS=${PRECOMPUTE_MAX_WORKERS:-4},
+                $SERVICE_ENV
+            }"
+        
+        print_status "Created Lambda function: $PRECOMPUTE_FUNCTION_NAME"
+    fi
+    
+    rm -f precompute-lambda.zip
+    cd "$SCRIPT_DIR"
+    
+    RULE_ARN=$(aws events put-rule \
+        --name "$PROJECT_NAME-precompute" \
+        --schedule-expression "${PRECOMPUTE_SCHEDULE:-cron(0 5 * * ? *)}" \
+        --query RuleArn --output text)
+    
+    aws lambda add-permission \
+        --function-name "$PRECOMPUTE_FUNCTION_NAME" \
+        --statement-id "$PROJECT_NAME-precompute" \
+        --action lambda:InvokeFunction \
+        --principal events.amazonaws.com \
+        --source-arn "$RULE_ARN" 2>/dev/null || print_warning "Precompute permission already exists"
+    
+    cat > /tmp/precompute-targets.json << EOF
+[
+    {
+        "Id": "precompute",
+        "Arn": "arn:aws:lambda:$AWS_REGION:$ACCOUNT_ID:function:$PRECOMPUTE_FUNCTION_NAME",
+        "Input": "{\\"mine_limit\\": ${PRECOMPUTE_MINE_LIMIT:-20}}"
+    }
+]
+EOF
+    
+    aws events put-targets --rule "$PROJECT_NAME-precompute" --targets file:///tmp/precompute-targets.json
+    rm -f /tmp/precompute-targets.json
+    
+    print_status "Created precompute schedule: $PROJECT_NAME-precompute"
+}
+
 # Function to upload sample background music
 upload_sample_music() {
     print_status "Uploading sample background music..."
@@ -594,11 +837,15 @@ main() {
     # Create infrastructure
     create_s3_buckets
     create_dynamodb_table
+    create_admission_table
     create_iam_roles
     configure_bucket_policies
     create_lambda_function
+    create_aggregates_consumer
     create_api_gateway
     create_step_functions
+    create_warmup_schedule
+    create_precompute_job
     upload_sample_music
     
     # Update configuration
@@ -0,0 +1,410 @@
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# DynamoDB table shared by warm containers; unset means a per-container local store
+ADMISSION_TABLE = os.environ.get('ADMISSION_TABLE', '')
+
+# Per-service limits: token refill rate (requests/second), burst size, and the
+# bounds the adaptive concurrency limit moves between
+ADMISSION_LIMITS = {
+    'bedrock': {
+        'rate': float(os.environ.get('BEDROCK_RATE_LIMIT', '2')),
+        'burst': float(os.environ.get('BEDROCK_BURST_LIMIT', '5')),
+        'min_concurrency': 1,
+        'max_concurrency': int(os.environ.get('BEDROCK_MAX_CONCURRENCY', '10'))
+    },
+    'polly': {
+        'rate': float(os.environ.get('POLLY_RATE_LIMIT', '8')),
+        'burst': float(os.environ.get('POLLY_BURST_LIMIT', '16')),
+        'min_concurrency': 1,
+        'max_concurrency': int(os.environ.get('POLLY_MAX_CONCURRENCY', '20'))
+    }
+}
+
+# How long a caller may wait for admission, and how many may wait per container
+ADMISSION_DEADLINE_SECONDS = float(os.environ.get('ADMISSION_DEADLINE_SECONDS', '5'))
+ADMISSION_MAX_WAITERS = int(os.environ.get('ADMISSION_MAX_WAITERS', '8'))
+
+# Leases outlive a crashed container by at most this long
+LEASE_SECONDS = 60
+
+# Waiters poll the shared state with exponential backoff between these bounds
+POLL_SECONDS = 0.05
+MAX_POLL_SECONDS = 1.0
+
+# Attempts to record a throttling signal before giving up and logging it
+LIMIT_UPDATE_ATTEMPTS = 5
+
+# Error codes the AWS services use to signal throttling
+THROTTLING_ERROR_CODES = {
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'ServiceQuotaExceededException',
+    'ProvisionedThroughputExceededException',
+    'RequestLimitExceeded'
+}
+
+class AdmissionRejected(Exception):
+    """Raised when a call cannot be admitted before its deadline"""
+
+def is_throttling_error(error: Exception) -> bool:
+    """Check whether an exception is a service throttling signal"""
+    response = getattr(error, 'response', None) or {}
+    code = response.get('Error', {}).get('Code', '')
+    return code in THROTTLING_ERROR_CODES or type(error).__name__ in THROTTLING_ERROR_CODES
+
+class LocalCoordinationStore:
+    """In-memory limiter state; shared by threads of one container
+
+    Implements the same atomic operations as DynamoDBCoordinationStore.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items: Dict[str, Dict] = {}
+
+    def read(self, service: str) -> Optional[Dict]:
+        with self._lock:
+            state = self._items.get(service)
+            return dict(state, leases=dict(state['leases'])) if state else None
+
+    def create(self, service: str, state: Dict) -> bool:
+        """Store the initial state unless another caller already did"""
+        with self._lock:
+            if service in self._items:
+                return False
+            self._items[service] = dict(state, leases=dict(state['leases']))
+            return True
+
+    def refill(self, service: str, delta: float, refilled_at: float, previous_refilled_at: float) -> bool:
+        """Add `delta` tokens if nobody has refilled since `previous_refilled_at`"""
+        with self._lock:
+            state = self._items[service]
+            if state['refilled_at'] != previous_refilled_at:
+                return False
+            state['tokens'] += delta
+            state['refilled_at'] = refilled_at
+            return True
+
+    def take(self, service: str, lease_id: str, expires_at: float, max_leases: int) -> bool:
+        """Take a token and record a lease if one is left and the limit allows it"""
+        with self._lock:
+            state = self._items[service]
+            if state['tokens'] < 1 or len(state['leases']) >= max_leases:
+                return False
+            state['tokens'] -= 1
+            state['leases'][lease_id] = expires_at
+            return True
+
+    def release(self, service: str, lease_id: str, limit_increment: float, max_limit: float):
+        """Drop a lease, growing the limit by `limit_increment` while it stays within `max_limit`"""
+        with self._lock:
+            state = self._items[service]
+            state['leases'].pop(lease_id, None)
+            if state['limit'] + limit_increment <= max_limit:
+                state['limit'] += limit_increment
+
+    def remove_leases(self, service: str, lease_ids: List[str]):
+        with self._lock:
+            for lease_id in lease_ids:
+                self._items[service]['leases'].pop(lease_id, None)
+
+    def set_limit(self, service: str, limit: float, previous_limit: float, drain_tokens: bool) -> bool:
+        """Set the concurrency limit if it is still `previous_limit`"""
+        with self._lock:
+            state = self._items[service]
+            if state['limit'] != previous_limit:
+                return False
+            state['limit'] = limit
+            if drain_tokens:
+                state['tokens'] = min(state['tokens'], 0.0)
+            return True
+
+def _decimal(value: float) -> Decimal:
+    """DynamoDB numbers must be passed to boto3 as Decimals"""
+    return Decimal(str(round(value, 6)))
+
+class DynamoDBCoordinationStore:
+    """Limiter state on a DynamoDB item, shared by all warm containers
+
+    Tokens, leases and the limit are separate attributes changed by single
+    conditional UpdateItem calls, so concurrent containers never have to
+    rewrite, and retry, the whole item.
+    """
+
+    NAMES = {'#tokens': 'tokens', '#refilled_at': 'refilled_at', '#limit': 'limit', '#leases': 'leases'}
+
+    def __init__(self, table_name: str):
+        import boto3
+        self.table = boto3.resource('dynamodb').Table(table_name)
+        self._condition_failed = self.table.meta.client.exceptions.ConditionalCheckFailedException
+
+    def _update(self, service: str, expression: str, values: Optional[Dict] = None,
+                condition: Optional[str] = None, names: Optional[Dict] = None) -> bool:
+        """One atomic UpdateItem; False if its condition did not hold"""
+        # DynamoDB rejects attribute names that the expressions don't use
+        used = f'{expression} {condition or ""}'
+        kwargs = {
+            'Key': {'service': service},
+            'UpdateExpression': expression,
+            'ExpressionAttributeNames': {
+                name: value for name, value in dict(self.NAMES, **(names or {})).items()
+                if re.search(re.escape(name) + r'\b', used)
+            }
+        }
+        if values:
+            kwargs['ExpressionAttributeValues'] = values
+        if condition:
+            kwargs['ConditionExpression'] = condition
+        try:
+            self.table.update_item(**kwargs)
+            return True
+        except self._condition_failed:
+            return False
+
+    def read(self, service: str) -> Optional[Dict]:
+        item = self.table.get_item(Key={'service': service}, ConsistentRead=True).get('Item')
+        if not item or 'tokens' not in item:
+            return None
+        return {
+            'tokens': float(item['tokens']),
+            'refilled_at': float(item['refilled_at']),
+            'limit': float(item['limit']),
+            'leases': {lease_id: float(expires) for lease_id, expires in item.get('leases', {}).items()}
+        }
+
+    def create(self, service: str, state: Dict) -> bool:
+        """Store the initial state unless another container already did"""
+        return self._update(
+            service,
+            'SET #tokens = :tokens, #refilled_at = :refilled_at, #limit = :limit, #leases = :leases',
+            {
+                ':tokens': _decimal(state['tokens']),
+                ':refilled_at': _decimal(state['refilled_at']),
+                ':limit': _decimal(state['limit']),
+                ':leases': {}
+            },
+            condition='attribute_not_exists(#tokens)'
+        )
+
+    def refill(self, service: str, delta: float, refilled_at: float, previous_refilled_at: float) -> bool:
+        """Add `delta` tokens if nobody has refilled since `previous_refilled_at`
+
+        The addition is relative, so tokens taken since the caller's read stay taken.
+        """
+        return self._update(
+            service,
+            'SET #refilled_at = :refilled_at ADD #tokens :delta',
+            {
+                ':delta': _decimal(delta),
+                ':refilled_at': _decimal(refilled_at),
+                ':previous': _decimal(previous_refilled_at)
+            },
+            condition='#refilled_at = :previous'
+        )
+
+    def take(self, service: str, lease_id: str, expires_at: float, max_leases: int) -> bool:
+        """Take a token and record a lease if one is left and the limit allows it"""
+        return self._update(
+            service,
+            'SET #leases.#lease = :expires_at ADD #tokens :minus_one',
+            {':expires_at': _decimal(expires_at), ':minus_one': -1, ':one': 1, ':max_leases': max_leases},
+            condition='#tokens >= :one AND size(#leases) < :max_leases',
+            names={'#lease': lease_id}
+        )
+
+    def release(self, service: str, lease_id: str, limit_increment: float, max_limit: float):
+        """Drop a lease, growing the limit by `limit_increment` while it stays within `max_limit`"""
+        if limit_increment > 0 and self._update(
+            service,
+            'REMOVE #leases.#lease ADD #limit :increment',
+            {':increment': _decimal(limit_increment), ':ceiling': _decimal(max_limit - limit_increment)},
+            condition='#limit <= :ceiling',
+            names={'#lease': lease_id}
+        ):
+            return
+        self.remove_leases(service, [lease_id])
+
+    def remove_leases(self, service: str, lease_ids: List[str]):
+        names = {f'#lease{i}': lease_id for i, lease_id in enumerate(lease_ids)}
+        self._update(service, 'REMOVE ' + ', '.join(f'#leases.{name}' for name in names), names=names)
+
+    def set_limit(self, service: str, limit: float, previous_limit: float, drain_tokens: bool) -> bool:
+        """Set the concurrency limit if it is still `previous_limit`"""
+        expression = 'SET #limit = :limit'
+        values = {':limit': _decimal(limit), ':previous': _decimal(previous_limit)}
+        if drain_tokens:
+            # Tokens never go below zero through take, so draining is a plain set
+            expression += ', #tokens = :zero'
+            values[':zero'] = 0
+        return self._update(service, expression, values, condition='#limit = :previous')
+
+class AdmissionController:
+    """Token-bucket rate limit plus adaptive (AIMD) concurrency limit for one service
+
+    State lives in a coordination store so every warm container shares the same
+    tokens, in-flight leases and concurrency limit. The limit grows by about one
+    slot per limit's worth of successful calls and halves on a throttling signal.
+    """
+
+    def __init__(self, service: str, store, rate: float, burst: float,
+                 min_concurrency: int, max_concurrency: int,
+                 deadline_seconds: float = ADMISSION_DEADLINE_SECONDS,
+                 max_waiters: int = ADMISSION_MAX_WAITERS):
+        self.service = service
+        self.store = store
+        self.rate = rate
+        self.burst = burst
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.deadline_seconds = deadline_seconds
+        self.max_waiters = max_waiters
+        self._waiters = 0
+        self._waiters_lock = threading.Lock()
+        # Limit each lease was admitted under, which sizes its additive increase
+        self._lease_limits: Dict[str, float] = {}
+
+    def _initial_state(self, now: float) -> Dict:
+        return {
+            'tokens': self.burst,
+            'refilled_at': now,
+            'limit': float(self.max_concurrency),
+            'leases': {}
+        }
+
+    def _state(self, now: float) -> Dict:
+        """Current shared state, created on first use"""
+        state = self.store.read(self.service)
+        if state is None:
+            self.store.create(self.service, self._initial_state(now))
+            state = self.store.read(self.service)
+        return state
+
+    def warm_up(self):
+        """Open the coordination store's connection and create the state if missing"""
+        self._state(time.time())
+
+    def _try_acquire(self, lease_id: str) -> Tuple[bool, float]:
+        """Take a token and a concurrency slot; returns (admitted, suggested wait)"""
+        now = time.time()
+        state = self._state(now)
+
+        # Refill from elapsed time; if another container refilled first, its refill stands.
+        # Only refills raise the count and each one moves refilled_at, so the stored count
+        # can only be at or below this read and adding the delta never overshoots the burst
+        delta = min(self.burst - state['tokens'], max(0.0, now - state['refilled_at']) * self.rate)
+        tokens = state['tokens']
+        if delta > 0 and self.store.refill(self.service, delta, now, state['refilled_at']):
+            tokens += delta
+
+        # Expire leases left behind by crashed containers
+        expired = [lease for lease, expires_at in state['leases'].items() if expires_at <= now]
+        if expired:
+            self.store.remove_leases(self.service, expired)
+
+        limit = int(state['limit'])
+        if len(state['leases']) - len(expired) >= limit:
+            return False, POLL_SECONDS
+        if tokens < 1:
+            return False, max(POLL_SECONDS, (1 - tokens) / self.rate)
+
+        admitted = self.store.take(self.service, lease_id, now + LEASE_SECONDS, limit)
+        if admitted:
+            self._lease_limits[lease_id] = state['limit']
+        return admitted, POLL_SECONDS
+
+    def acquire(self, deadline: Optional[float] = None) -> str:
+        """Wait for admission until the deadline; returns a lease id to release"""
+        deadline = deadline or time.time() + self.deadline_seconds
+        with self._waiters_lock:
+            if self._waiters >= self.max_waiters:
+                raise AdmissionRejected(f"{self.service} wait queue is full")
+            self._waiters += 1
+
+        lease_id = str(uuid.uuid4())
+        backoff = POLL_SECONDS
+        try:
+            while True:
+                admitted, wait_seconds = self._try_acquire(lease_id)
+                if admitted:
+                    return lease_id
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise AdmissionRejected(f"{self.service} admission deadline exceeded")
+                # Back off exponentially, with jitter so waiting containers don't poll in lockstep
+                time.sleep(min(remaining, max(wait_seconds, backoff) * random.uniform(1.0, 1.5)))
+                backoff = min(MAX_POLL_SECONDS, backoff * 2)
+        finally:
+            with self._waiters_lock:
+                self._waiters -= 1
+
+    def release(self, lease_id: str, throttled: bool = False):
+        """Return a slot and feed the outcome into the adaptive limit"""
+        admitted_limit = self._lease_limits.pop(lease_id, float(self.max_concurrency))
+        try:
+            self.store.release(
+                self.service, lease_id,
+                0.0 if throttled else 1 / admitted_limit,
+                float(self.max_concurrency)
+            )
+        except Exception as e:
+            logger.warning(
+                f"Error releasing {self.service} admission lease, it expires in {LEASE_SECONDS}s: {e}"
+            )
+
+        if not throttled:
+            return
+        try:
+            for _ in range(LIMIT_UPDATE_ATTEMPTS):
+                state = self.store.read(self.service)
+                if state is None:
+                    return
+                limit = max(float(self.min_concurrency), state['limit'] / 2)
+                # Drain the bucket so every container backs off together
+                if self.store.set_limit(self.service, limit, state['limit'], drain_tokens=True):
+                    return
+            logger.warning(
+                f"Could not record {self.service} throttling after {LIMIT_UPDATE_ATTEMPTS} attempts"
+            )
+        except Exception as e:
+            logger.warning(f"Error reducing {self.service} concurrency limit: {e}")
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """Invoke `fn` under admission control, retrying throttled calls until the deadline"""
+        deadline = time.time() + self.deadline_seconds
+        while True:
+            lease_id = self.acquire(deadline)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                throttled = is_throttling_error(e)
+                self.release(lease_id, throttled=throttled)
+                if throttled and time.time() < deadline:
+                    logger.warning(f"{self.service} throttled, retrying under reduced limit")
+                    continue
+                raise
+            self.release(lease_id)
+            return result
+
+_store = None
+_controllers: Dict[str, AdmissionController] = {}
+
+def get_admission_controller(service: str) -> AdmissionController:
+    """Per-container admission controller for a service, built on first use"""
+    global _store
+    if service not in _controllers:
+        if _store is None:
+            _store = DynamoDBCoordinationStore(ADMISSION_TABLE) if ADMISSION_TABLE else LocalCoordinationStore()
+        _controllers[service] = AdmissionController(service, _store, **ADMISSION_LIMITS[service])
+    return _controllers[service]
@@ -4,53 +4,200 @@ import base64
 import io
 import os
 import logging
-from typing import Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 import tempfile
 import subprocess
 
+from profiling import checkpoint, profiled
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Accept-style media types mapped to the audio format tokens used internally
+AUDIO_MEDIA_TYPES = {
+    'audio/ogg': 'ogg',
+    'audio/vorbis': 'ogg',
+    'ogg': 'ogg',
+    'ogg_vorbis': 'ogg',
+    'audio/opus': 'opus',
+    'opus': 'opus',
+    'audio/mpeg': 'mp3',
+    'audio/mp3': 'mp3',
+    'mp3': 'mp3'
+}
+
+# Mixed output encodings in server preference order; speech over ambient music
+# stays transparent at far lower bitrates with Opus or Vorbis than with MP3
+MIX_OUTPUT_FORMATS = {
+    'opus': {
+        'extension': 'opus',
+        'content_type': 'audio/ogg; codecs=opus',
+        'codec_args': ['-c:a', 'libopus', '-b:a', '48k', '-vbr', 'on', '-application', 'audio']
+    },
+    'ogg': {
+        'extension': 'ogg',
+        'content_type': 'audio/ogg',
+        'codec_args': ['-c:a', 'libvorbis', '-b:a', '80k']
+    },
+    'mp3': {
+        'extension': 'mp3',
+        'content_type': 'audio/mpeg',
+        'codec_args': ['-c:a', 'mp3', '-b:a', '192k']
+    }
+}
+DEFAULT_MIX_FORMAT = 'mp3'
+
+# Batch mode: narrations mixed per ffmpeg process, ffmpeg processes run at once,
+# and concurrent S3 downloads and uploads
+MIX_BATCH_MAX_INPUTS = int(os.environ.get('MIX_BATCH_MAX_INPUTS', '8'))
+MIX_BATCH_WORKERS = int(os.environ.get('MIX_BATCH_WORKERS', str(os.cpu_count() or 2)))
+MIX_BATCH_IO_WORKERS = int(os.environ.get('MIX_BATCH_IO_WORKERS', '8'))
+
+def negotiate_audio_format(accept: Optional[str], supported: List[str], default: str) -> str:
+    """Pick the best supported audio format for an Accept-style preference string
+
+    Entries are weighted by their q parameter; ties go to the order of `supported`.
+    """
+    if not accept:
+        return default
+    
+    best_format, best_quality = None, 0.0
+    for media_range in accept.split(','):
+        parts = [part.strip().lower() for part in media_range.split(';')]
+        media_type, quality, codecs = parts[0], 1.0, ''
+        for param in parts[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+            elif name.strip() == 'codecs':
+                codecs = value.strip().strip('"')
+        
+        if media_type in ('*/*', 'audio/*', '*'):
+            candidates = supported
+        else:
+            audio_format = 'opus' if codecs == 'opus' else AUDIO_MEDIA_TYPES.get(media_type)
+            candidates = [audio_format] if audio_format in supported else []
+        
+        for candidate in candidates:
+            if quality > best_quality or (
+                quality == best_quality and best_format is not None
+                and supported.index(candidate) < supported.index(best_format)
+            ):
+                best_format, best_quality = candidate, quality
+    
+    return best_format or default
+
+def detect_audio_format(audio: bytes, key: Optional[str] = None) -> str:
+    """Format of encoded audio, from its container signature or else the key's extension
+
+    Narration can be Polly MP3 or Ogg Vorbis, so unmixed narration has to be served
+    with its real format rather than the requested mix format.
+    """
+    if audio.startswith(b'OggS'):
+        return 'opus' if b'OpusHead' in audio[:64] else 'ogg'
+    if audio.startswith(b'ID3') or (len(audio) > 1 and audio[0] == 0xFF and audio[1] & 0xE0 == 0xE0):
+        return 'mp3'
+    extension = os.path.splitext((key or '').split('?')[0])[1].lstrip('.').lower()
+    return AUDIO_MEDIA_TYPES.get(extension, DEFAULT_MIX_FORMAT)
+
+def parse_mix_job(event: Dict) -> Dict:
+    """Validate a mix request and resolve its output format"""
+    if not isinstance(event, dict):
+        raise ValueError("Mix request must be a JSON object")
+    job = {
+        'narration_url': event.get('narration_url'),
+        'narration_key': event.get('narration_key'),
+        'music_style': event.get('music_style', 'ambient_world'),
+        'request_id': event.get('request_id'),
+        'output_format': negotiate_audio_format(
+            event.get('accept'), list(MIX_OUTPUT_FORMATS), DEFAULT_MIX_FORMAT
+        )
+    }
+    if not (job['narration_url'] or job['narration_key']) or not job['request_id']:
+        raise ValueError("Missing required parameters: narration_url or narration_key, and request_id")
+    return job
+
 class AudioMixer:
     """Audio mixing utility for combining narration and background music"""
     
-    def __init__(self):
-        self.s3 = boto3.client('s3')
+    # Whether ffmpeg is on the PATH, probed once per container
+    _ffmpeg_available: Optional[bool] = None
+    
+    def __init__(self, s3_client=None):
+        self.s3 = s3_client or boto3.client('s3')
         self.generated_content_bucket = os.environ.get('GENERATED_CONTENT_BUCKET')
         self.music_bucket = os.environ.get('MUSIC_BUCKET')
         
-    def mix_audio(self, narration_url: str, music_style: str, request_id: str) -> str:
+    def mix_audio(self, narration_url: str, music_style: str, request_id: str,
+                  output_format: str = DEFAULT_MIX_FORMAT, narration_key: Optional[str] = None) -> str:
         """
         Mix narration audio with background music
         
         Args:
             narration_url: S3 URL of the narration audio
+            narration_key: Key of the narration in the generated content bucket,
+                used instead of parsing narration_url when given
             music_style: Style of background music to use
             request_id: Unique request identifier
+            output_format: Key of MIX_OUTPUT_FORMATS to encode the mix as
             
         Returns:
-            S3 URL of the mixed audio file
+            S3 URL of the mixed audio file, or of the narration itself when
+            mixing is not possible
         """
         try:
+            # Reuse a rendition already mixed in this format
+            key = self._mixed_audio_key(request_id, output_format)
+            if self._rendition_exists(key):
+                return self._presign_mixed_audio(key)
+            
             # Download narration audio
-            narration_audio = self._download_audio(narration_url)
+            narration_audio = self._download_narration(narration_url, narration_key)
             
             # Get background music
             background_music = self._get_background_music(music_style)
             
             # Mix audio files
-            mixed_audio = self._mix_audio_files(narration_audio, background_music)
+            mixed_audio = self.mix_audio_bytes(narration_audio, background_music, output_format)
+            checkpoint('audio_mixed')
+            
+            if mixed_audio is None:
+                # Only real mixes go under the mixed key, so a later call can still mix
+                return self._narration_url(narration_url, narration_key, detect_audio_format(narration_audio))
             
             # Upload mixed audio
-            mixed_audio_url = self._upload_mixed_audio(mixed_audio, request_id)
+            mixed_audio_url = self._upload_mixed_audio(mixed_audio, request_id, output_format)
             
             return mixed_audio_url
             
         except Exception as e:
             logger.error(f"Error mixing audio: {e}")
             # Return original narration if mixing fails
-            return narration_url
+            return self._narration_url(narration_url, narration_key)
+    
+    def _narration_url(self, narration_url: Optional[str], narration_key: Optional[str],
+                       audio_format: Optional[str] = None) -> str:
+        """URL to serve the unmixed narration from"""
+        if narration_url or not narration_key:
+            return narration_url or ''
+        params = {'Bucket': self.generated_content_bucket, 'Key': narration_key}
+        if audio_format:
+            params['ResponseContentType'] = MIX_OUTPUT_FORMATS[audio_format]['content_type']
+        return self.s3.generate_presigned_url('get_object', Params=params, ExpiresIn=3600)
+    
+    def _download_narration(self, narration_url: Optional[str], narration_key: Optional[str]) -> bytes:
+        """Download narration by key in the generated content bucket, or by URL"""
+        if narration_key:
+            return self.s3.get_object(
+                Bucket=self.generated_content_bucket,
+                Key=narration_key
+            )['Body'].read()
+        return self._download_audio(narration_url)
     
     def _download_audio(self, audio_url: str) -> bytes:
         """Download audio file from S3"""
@@ -100,11 +247,23 @@ class AudioMixer:
             # Return empty bytes if music not available
             return b''
     
-    def _mix_audio_files(self, narration_audio: bytes, background_music: bytes) -> bytes:
-        """Mix narration and background music using ffmpeg"""
+    def mix_audio_bytes(self, narration_audio: bytes, background_music: bytes,
+                        output_format: str = DEFAULT_MIX_FORMAT) -> Optional[bytes]:
+        """Mix in-memory narration and background music with ffmpeg
+
+        Returns None when mixing is not possible (no music, no ffmpeg or an ffmpeg
+        error) so callers can fall back to serving the narration on its own.
+        """
+        if not narration_audio or not background_music:
+            return None
+        if not self.is_ffmpeg_available():
+            logger.warning("ffmpeg not available, skipping mix")
+            return None
+        
+        narration_path = music_path = output_path = ''
         try:
             # Create temporary files
-            with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as narration_file:
+            with tempfile.NamedTemporaryFile(suffix='.audio', delete=False) as narration_file:
                 narration_file.write(narration_audio)
                 narration_path = narration_file.name
             
@@ -112,45 +271,45 @@ class AudioMixer:
                 music_file.write(background_music)
                 music_path = music_file.name
             
-            with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as output_file:
+            # ffmpeg picks the output container from the file extension
+            extension = MIX_OUTPUT_FORMATS[output_format]['extension']
+            with tempfile.NamedTemporaryFile(suffix=f'.{extension}', delete=False) as output_file:
                 output_path = output_file.name
             
-            # Use ffmpeg to mix audio (if available)
-            if self._is_ffmpeg_available():
-                return self._mix_with_ffmpeg(narration_path, music_path, output_path)
-            else:
-                # Fallback: return narration only
-                logger.warning("ffmpeg not available, returning narration only")
-                return narration_audio
+            return self._mix_with_ffmpeg(narration_path, music_path, output_path, output_format)
                 
         except Exception as e:
             logger.error(f"Error mixing audio files: {e}")
-            return narration_audio
+            return None
         finally:
             # Clean up temporary files
             for path in [narration_path, music_path, output_path]:
-                if os.path.exists(path):
+                if path and os.path.exists(path):
                     os.unlink(path)
     
-    def _is_ffmpeg_available(self) -> bool:
-        """Check if ffmpeg is available"""
-        try:
-            subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
-            return True
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            return False
+    @staticmethod
+    def is_ffmpeg_available() -> bool:
+        """Check if ffmpeg is available, probing it once per container"""
+        if AudioMixer._ffmpeg_available is None:
+            try:
+                subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
+                AudioMixer._ffmpeg_available = True
+            except (subprocess.CalledProcessError, FileNotFoundError):
+                AudioMixer._ffmpeg_available = False
+        return AudioMixer._ffmpeg_available
     
-    def _mix_with_ffmpeg(self, narration_path: str, music_path: str, output_path: str) -> bytes:
+    def _mix_with_ffmpeg(self, narration_path: str, music_path: str, output_path: str,
+                         output_format: str = DEFAULT_MIX_FORMAT) -> Optional[bytes]:
         """Mix audio using ffmpeg"""
         try:
-            # Mix narration (volume 1.0) with background music (volume 0.3)
+            # Mix narration (volume 1.0) with looped background music (volume 0.3),
+            # ending with the narration rather than running the full music bed
             cmd = [
                 'ffmpeg',
                 '-i', narration_path,
-                '-i', music_path,
-                '-filter_complex', '[0:a]volume=1.0[narration];[1:a]volume=0.3[music];[narration][music]amix=inputs=2:duration=longest',
-                '-c:a', 'mp3',
-                '-b:a', '192k',
+                '-stream_loop', '-1', '-i', music_path,
+                '-filter_complex', '[0:a]volume=1.0[narration];[1:a]volume=0.3[music];[narration][music]amix=inputs=2:duration=first',
+                *MIX_OUTPUT_FORMATS[output_format]['codec_args'],
                 output_path,
                 '-y'  # Overwrite output file
             ]
@@ -163,59 +322,262 @@ class AudioMixer:
                 
         except subprocess.CalledProcessError as e:
             logger.error(f"ffmpeg error: {e}")
-            # Return narration only if mixing fails
-            with open(narration_path, 'rb') as f:
-                return f.read()
+            return None
+    
+    def mix_batch(self, jobs: List[Dict]) -> List[Dict]:
+        """Mix many narrations, fetching and decoding each music bed only once
+        
+        Jobs take the same fields as a single mix request. They are grouped by
+        music style; each style's bed is decoded to PCM once and up to
+        MIX_BATCH_MAX_INPUTS narrations are mixed against it per ffmpeg process.
+        Downloads and uploads run concurrently.
+        
+        Returns one result per job, in order, with a 'status' of 'mixed',
+        'cached', 'unmixed' (mixing was not possible, so the URL points at the
+        narration itself and nothing is stored under the mixed key) or 'failed'
+        with an 'error'.
+        """
+        results: List[Optional[Dict]] = [None] * len(jobs)
+        parsed: Dict[int, Dict] = {}
+        for index, job in enumerate(jobs):
+            try:
+                parsed[index] = parse_mix_job(job)
+            except Exception as e:
+                request_id = job.get('request_id') if isinstance(job, dict) else None
+                results[index] = {'request_id': request_id, 'status': 'failed', 'error': str(e)}
+        
+        def result(index: int, status: str, **fields) -> Dict:
+            job = parsed[index]
+            return dict({
+                'request_id': job['request_id'],
+                'music_style': job['music_style'],
+                'output_format': job['output_format'],
+                'status': status
+            }, **fields)
+        
+        with ThreadPoolExecutor(max_workers=MIX_BATCH_IO_WORKERS) as io_pool:
+            # Reuse renditions already mixed in the requested format
+            keys = {index: self._mixed_audio_key(job['request_id'], job['output_format'])
+                    for index, job in parsed.items()}
+            exists = dict(zip(keys, io_pool.map(self._rendition_exists, keys.values())))
+            groups: Dict[str, List[int]] = {}
+            for index, job in parsed.items():
+                if exists[index]:
+                    results[index] = result(index, 'cached', mixed_audio_url=self._presign_mixed_audio(keys[index]))
+                else:
+                    groups.setdefault(job['music_style'], []).append(index)
+            
+            narration_futures = {
+                index: io_pool.submit(self._download_narration, parsed[index]['narration_url'],
+                                      parsed[index]['narration_key'])
+                for indices in groups.values() for index in indices
+            }
+            music_futures = {style: io_pool.submit(self._get_background_music, style) for style in groups}
+            
+            with tempfile.TemporaryDirectory() as directory:
+                # Each upload is (job index, mixed file to upload)
+                uploads: List[Tuple[int, str]] = []
+                chunks: List[Tuple[str, List[Tuple[int, str, str]]]] = []
+                narration_formats: Dict[int, str] = {}
+                can_mix = self.is_ffmpeg_available()
+                
+                for style, indices in groups.items():
+                    ready = []
+                    for index in indices:
+                        try:
+                            narration_audio = narration_futures[index].result()
+                            narration_formats[index] = detect_audio_format(
+                                narration_audio, parsed[index]['narration_key'] or parsed[index]['narration_url']
+                            )
+                            narration_path = os.path.join(directory, f'narration-{index}.audio')
+                            with open(narration_path, 'wb') as f:
+                                f.write(narration_audio)
+                            ready.append(index)
+                        except Exception as e:
+                            logger.error(f"Error downloading narration for {parsed[index]['request_id']}: {e}")
+                            results[index] = result(index, 'failed', error=f'narration download failed: {e}')
+                    
+                    background_music = music_futures[style].result()
+                    bed_path = None
+                    if can_mix and background_music and ready:
+                        bed_path = self._decode_music_bed(background_music, directory, style)
+                    
+                    if bed_path is None:
+                        # Mixing is not possible; serve the narration without storing it as a mix
+                        for index in ready:
+                            job = parsed[index]
+                            try:
+                                results[index] = result(
+                                    index, 'unmixed', output_format=narration_formats[index],
+                                    mixed_audio_url=self._narration_url(
+                                        job['narration_url'], job['narration_key'], narration_formats[index]
+                                    )
+                                )
+                            except Exception as e:
+                                results[index] = result(index, 'failed', error=str(e))
+                        continue
+                    
+                    outputs = [
+                        (index, os.path.join(directory, f'narration-{index}.audio'),
+                         os.path.join(directory, f"mixed-{index}.{MIX_OUTPUT_FORMATS[parsed[index]['output_format']]['extension']}"))
+                        for index in ready
+                    ]
+                    for start in range(0, len(outputs), MIX_BATCH_MAX_INPUTS):
+                        chunks.append((bed_path, outputs[start:start + MIX_BATCH_MAX_INPUTS]))
+                
+                with ThreadPoolExecutor(max_workers=MIX_BATCH_WORKERS) as mix_pool:
+                    chunk_errors = list(mix_pool.map(
+                        lambda chunk: self._mix_chunk(chunk[0], chunk[1], parsed), chunks
+                    ))
+                checkpoint('audio_mixed')
+                
+                for (_, outputs), errors in zip(chunks, chunk_errors):
+                    for index, _, output_path in outputs:
+                        if index in errors:
+                            results[index] = result(index, 'failed', error=errors[index])
+                        else:
+                            uploads.append((index, output_path))
+                
+                def upload(item: Tuple[int, str]) -> Dict:
+                    index, path = item
+                    job = parsed[index]
+                    try:
+                        with open(path, 'rb') as f:
+                            url = self._upload_mixed_audio(f.read(), job['request_id'], job['output_format'])
+                        return result(index, 'mixed', mixed_audio_url=url)
+                    except Exception as e:
+                        return result(index, 'failed', error=f'upload failed: {e}')
+                
+                for (index, _), uploaded in zip(uploads, io_pool.map(upload, uploads)):
+                    results[index] = uploaded
+        
+        return results
+    
+    def _decode_music_bed(self, background_music: bytes, directory: str, music_style: str) -> Optional[str]:
+        """Decode a music bed to PCM once so every mix against it skips MP3 decoding"""
+        music_path = os.path.join(directory, f'music-{music_style}.mp3')
+        bed_path = os.path.join(directory, f'bed-{music_style}.wav')
+        with open(music_path, 'wb') as f:
+            f.write(background_music)
+        try:
+            subprocess.run(
+                ['ffmpeg', '-y', '-i', music_path, '-vn', '-c:a', 'pcm_s16le', bed_path],
+                check=True, capture_output=True
+            )
+            return bed_path
+        except subprocess.CalledProcessError as e:
+            logger.error(f"ffmpeg error decoding {music_style} bed: {e}")
+            return None
+        finally:
+            os.unlink(music_path)
+    
+    def _mix_chunk(self, bed_path: str, outputs: List[Tuple[int, str, str]],
+                   jobs: Dict[int, Dict]) -> Dict[int, str]:
+        """Mix narrations against one decoded bed in a single ffmpeg process
+        
+        `outputs` holds (job index, narration path, output path). Returns errors by
+        job index; if the shared process fails, each narration is retried on its
+        own so one bad input does not fail the rest.
+        """
+        try:
+            self._mix_against_bed(bed_path, outputs, jobs)
+            return {}
+        except (subprocess.CalledProcessError, OSError) as e:
+            if len(outputs) == 1:
+                detail = (getattr(e, 'stderr', None) or b'').decode(errors='replace').strip().splitlines()
+                error = detail[-1] if detail else str(e)
+                logger.error(f"ffmpeg error mixing {jobs[outputs[0][0]]['request_id']}: {error}")
+                return {outputs[0][0]: f'mixing failed: {error}'}
+        
+        errors = {}
+        for output in outputs:
+            errors.update(self._mix_chunk(bed_path, [output], jobs))
+        return errors
+    
+    def _mix_against_bed(self, bed_path: str, outputs: List[Tuple[int, str, str]], jobs: Dict[int, Dict]):
+        """Run one ffmpeg process that splits the looped bed across every narration"""
+        count = len(outputs)
+        cmd = ['ffmpeg', '-y', '-stream_loop', '-1', '-i', bed_path]
+        # Same levels and duration as _mix_with_ffmpeg: narration at 1.0, music at 0.3
+        filters = ['[0:a]volume=0.3,asplit=' + str(count) + ''.join(f'[music{i}]' for i in range(count))]
+        for i, (_, narration_path, _) in enumerate(outputs):
+            cmd += ['-i', narration_path]
+            filters.append(
+                f'[{i + 1}:a]volume=1.0[narration{i}];'
+                f'[narration{i}][music{i}]amix=inputs=2:duration=first[mix{i}]'
+            )
+        cmd += ['-filter_complex', ';'.join(filters)]
+        for i, (index, _, output_path) in enumerate(outputs):
+            cmd += ['-map', f'[mix{i}]', *MIX_OUTPUT_FORMATS[jobs[index]['output_format']]['codec_args'], output_path]
+        
+        subprocess.run(cmd, check=True, capture_output=True)
+    
+    def _mixed_audio_key(self, request_id: str, output_format: str) -> str:
+        """S3 key for a mixed rendition, keyed by request and format"""
+        return f"audio/mixed/{request_id}.{MIX_OUTPUT_FORMATS[output_format]['extension']}"
     
-    def _upload_mixed_audio(self, mixed_audio: bytes, request_id: str) -> str:
+    def _rendition_exists(self, key: str) -> bool:
+        """Check whether a rendition has already been stored"""
+        try:
+            self.s3.head_object(Bucket=self.generated_content_bucket, Key=key)
+            return True
+        except Exception:
+            return False
+    
+    def _presign_mixed_audio(self, key: str) -> str:
+        """Generate a pre-signed URL for a stored mixed rendition"""
+        return self.s3.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': self.generated_content_bucket,
+                'Key': key
+            },
+            ExpiresIn=3600
+        )
+    
+    def _upload_mixed_audio(self, mixed_audio: bytes, request_id: str,
+                            output_format: str = DEFAULT_MIX_FORMAT) -> str:
         """Upload mixed audio to S3 and return URL"""
         try:
-            key = f'audio/mixed/{request_id}.mp3'
+            key = self._mixed_audio_key(request_id, output_format)
             
             self.s3.put_object(
                 Bucket=self.generated_content_bucket,
                 Key=key,
                 Body=mixed_audio,
-                ContentType='audio/mpeg'
+                ContentType=MIX_OUTPUT_FORMATS[output_format]['content_type']
             )
             
             # Generate pre-signed URL
-            url = self.s3.generate_presigned_url(
-                'get_object',
-                Params={
-                    'Bucket': self.generated_content_bucket,
-                    'Key': key
-                },
-                ExpiresIn=3600
-            )
-            
-            return url
+            return self._presign_mixed_audio(key)
             
         except Exception as e:
             logger.error(f"Error uploading mixed audio: {e}")
             raise
 
+@profiled
 def lambda_handler(event, context):
     """Lambda handler for audio mixing"""
     try:
         # Parse input
-        narration_url = event.get('narration_url')
-        music_style = event.get('music_style', 'ambient_world')
-        request_id = event.get('request_id')
-        
-        if not narration_url or not request_id:
-            raise ValueError("Missing required parameters: narration_url and request_id")
+        job = parse_mix_job(event)
+        narration_url = job['narration_url']
+        narration_key = job['narration_key']
+        music_style = job['music_style']
+        request_id = job['request_id']
+        output_format = job['output_format']
         
         # Mix audio
         mixer = AudioMixer()
-        mixed_audio_url = mixer.mix_audio(narration_url, music_style, request_id)
+        mixed_audio_url = mixer.mix_audio(narration_url, music_style, request_id, output_format, narration_key)
         
         return {
             'statusCode': 200,
             'body': json.dumps({
                 'mixed_audio_url': mixed_audio_url,
                 'request_id': request_id,
-                'music_style': music_style
+                'music_style': music_style,
+                'output_format': output_format
             })
         }
         
@@ -226,4 +588,46 @@ def lambda_handler(event, context):
             'body': json.dumps({
                 'error': str(e)
             })
-        } 
\ No newline at end of file
+        } 
+
+@profiled
+def batch_lambda_handler(event, context):
+    """Lambda handler for batched audio mixing
+    
+    Accepts an SQS batch (each record body is a single mix request) or a direct
+    invocation with a 'jobs' list. SQS batches report failed messages through
+    batchItemFailures so only those are redelivered; direct invocations get the
+    per-job results.
+    """
+    records = event.get('Records')
+    if records:
+        jobs = []
+        for record in records:
+            try:
+                job = json.loads(record['body'])
+            except (KeyError, ValueError):
+                job = None
+            # An empty job fails validation and is reported like any other failure
+            jobs.append(job if isinstance(job, dict) else {})
+    else:
+        jobs = event.get('jobs', [])
+    
+    results = AudioMixer().mix_batch(jobs)
+    failed = sum(1 for result in results if result['status'] == 'failed')
+    logger.info(f"Mixed batch of {len(jobs)} jobs, {failed} failed")
+    
+    if records:
+        return {
+            'batchItemFailures': [
+                {'itemIdentifier': record['messageId']}
+                for record, result in zip(records, results) if result['status'] == 'failed'
+            ]
+        }
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'results': results,
+            'failed': failed
+        })
+    }
@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List
+
+from botocore.exceptions import (ConnectionClosedError, ConnectTimeoutError, EndpointConnectionError,
+                                 ReadTimeoutError)
+
+from admission import is_throttling_error
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Per-service breaker settings: consecutive failures that open the breaker, how
+# long it stays open before probing, and how many probes may run at once
+CIRCUIT_BREAKER_LIMITS = {
+    'bedrock': {
+        'failure_threshold': int(os.environ.get('BEDROCK_BREAKER_FAILURES', '3')),
+        'recovery_seconds': float(os.environ.get('BEDROCK_BREAKER_RECOVERY_SECONDS', '30')),
+        'half_open_probes': 1
+    },
+    'polly': {
+        'failure_threshold': int(os.environ.get('POLLY_BREAKER_FAILURES', '5')),
+        'recovery_seconds': float(os.environ.get('POLLY_BREAKER_RECOVERY_SECONDS', '15')),
+        'half_open_probes': 1
+    }
+}
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Errors raised without a response when the service cannot be reached or stops answering
+CONNECTION_FAILURES = (ConnectTimeoutError, ReadTimeoutError, EndpointConnectionError, ConnectionClosedError)
+
+# Recent transitions kept per container for the warm-up report
+MAX_RECORDED_TRANSITIONS = 20
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a service whose breaker is open"""
+
+def is_dependency_failure(error: Exception) -> bool:
+    """Check whether an exception says the service itself is unhealthy
+
+    Server errors, throttling that outlasted admission retries, timeouts and
+    connection failures count. Request and client-side errors, such as
+    validation failures, ParamValidationError or NoCredentialsError, do not.
+    """
+    if isinstance(error, CONNECTION_FAILURES):
+        return True
+    response = getattr(error, 'response', None)
+    if response:
+        status = response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return status >= 500 or is_throttling_error(error)
+    return False
+
+class CircuitBreaker:
+    """Per-container circuit breaker for one downstream service
+
+    Closed: calls pass through and consecutive failures are counted. Open: calls
+    fail fast with CircuitOpen until the recovery period has passed. Half-open:
+    a limited number of probe calls go through; a success closes the breaker and
+    a failure opens it again for another recovery period.
+    """
+
+    def __init__(self, service: str, failure_threshold: int, recovery_seconds: float,
+                 half_open_probes: int = 1):
+        self.service = service
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.transitions: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str, reason: str):
+        """Move to a new state and log it in a form log metric filters can match"""
+        transition = {
+            'circuitBreaker': self.service,
+            'from': self.state,
+            'to': state,
+            'reason': reason,
+            'failures': self.failures,
+            'at': int(time.time())
+        }
+        self.state = state
+        self.transitions = (self.transitions + [transition])[-MAX_RECORDED_TRANSITIONS:]
+        log = logger.warning if state == OPEN else logger.info
+        log(json.dumps(transition))
+
+    def _before_call(self) -> bool:
+        """Admit a call or raise CircuitOpen; returns whether the call is a probe"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.time() - self.opened_at < self.recovery_seconds:
+                    raise CircuitOpen(f"{self.service} circuit is open")
+                self._transition(HALF_OPEN, 'recovery period elapsed')
+            if self.state == HALF_OPEN:
+                if self.probes_in_flight >= self.half_open_probes:
+                    raise CircuitOpen(f"{self.service} circuit is half-open and probing")
+                self.probes_in_flight += 1
+                return True
+            return False
+
+    def _on_success(self, probe: bool):
+        with self._lock:
+            if probe:
+                self.probes_in_flight -= 1
+            self.failures = 0
+            if self.state == HALF_OPEN:
+                self._transition(CLOSED, 'probe succeeded')
+
+    def _on_failure(self, probe: bool, error: Exception):
+        with self._lock:
+            if probe:
+                self.probes_in_flight -= 1
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.opened_at = time.time()
+                self._transition(OPEN, f'{type(error).__name__}: {error}')
+
+    def _on_ignored(self, probe: bool):
+        """A call that says nothing about service health; frees its probe slot"""
+        if probe:
+            with self._lock:
+                self.probes_in_flight -= 1
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """Invoke `fn` unless the breaker is open, recording the outcome"""
+        probe = self._before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if is_dependency_failure(e):
+                self._on_failure(probe, e)
+            else:
+                self._on_ignored(probe)
+            raise
+        self._on_success(probe)
+        return result
+
+    def snapshot(self) -> Dict:
+        """Current state for monitoring"""
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'openedAt': int(self.opened_at) if self.state != CLOSED else None,
+                'transitions': list(self.transitions)
+            }
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(service: str) -> CircuitBreaker:
+    """Per-container circuit breaker for a service, built on first use"""
+    with _breakers_lock:
+        if service not in _breakers:
+            _breakers[service] = CircuitBreaker(service, **CIRCUIT_BREAKER_LIMITS[service])
+        return _breakers[service]
+
+def circuit_breaker_states() -> Dict[str, Dict]:
+    """Snapshot of every configured breaker, e.g. for the warm-up report"""
+    return {service: get_circuit_breaker(service).snapshot() for service in CIRCUIT_BREAKER_LIMITS}
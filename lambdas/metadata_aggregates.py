@@ -0,0 +1,224 @@
+import hashlib
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Initialize AWS clients
+dynamodb_client = boto3.client('dynamodb')
+dynamodb = boto3.resource('dynamodb')
+
+# Get configuration from environment variables
+AGGREGATES_TABLE = os.environ.get('AGGREGATES_TABLE', 'achamin-metadata-aggregates')
+
+# Stream records are retained for 24 hours; dedup markers only need to outlive them
+EVENT_MARKER_TTL_SECONDS = 2 * 24 * 3600
+
+# DynamoDB transactions are limited to 100 items
+MAX_TRANSACTION_ITEMS = 100
+
+# Transactions touching the same hot aggregates (e.g. 'total') from parallel
+# shards conflict; retry them a few times before failing the records
+TRANSACTION_CONFLICT_RETRIES = 3
+TRANSACTION_CONFLICT_BACKOFF_SECONDS = 0.1
+
+deserializer = TypeDeserializer()
+serializer = TypeSerializer()
+
+def _label_set_key(labels: List[str]) -> Tuple[str, List[str]]:
+    """Stable aggregate key for a set of labels, independent of order and case"""
+    normalized = sorted({label.lower() for label in labels})
+    digest = hashlib.sha1('|'.join(normalized).encode('utf-8')).hexdigest()
+    return f'labelset#{digest}', normalized
+
+def aggregate_contributions(item: Optional[Dict]) -> Dict[str, Dict]:
+    """Aggregate items a stored metadata item counts towards
+
+    Returns aggregate key -> attributes describing the aggregate (kind and, for
+    label sets, the labels themselves).
+    """
+    if not item:
+        return {}
+
+    contributions = {'total': {'kind': 'total'}}
+
+    mood = item.get('mood')
+    if mood:
+        contributions[f'mood#{mood}'] = {'kind': 'mood', 'value': mood}
+
+    themes = item.get('themes', '')
+    for theme in themes.split(',') if themes and themes != 'none' else []:
+        contributions[f'theme#{theme}'] = {'kind': 'theme', 'value': theme}
+
+    labels = item.get('labels') or []
+    if labels:
+        key, normalized = _label_set_key(labels)
+        contributions[key] = {'kind': 'labelset', 'labels': normalized}
+
+    timestamp = item.get('timestamp')
+    if timestamp is not None:
+        day = datetime.fromtimestamp(int(timestamp), tz=timezone.utc).strftime('%Y-%m-%d')
+        contributions[f'daily#{day}'] = {'kind': 'daily', 'value': day}
+
+    return contributions
+
+def record_deltas(record: Dict) -> Dict[str, Tuple[int, Dict]]:
+    """Count changes a single stream record makes to each aggregate"""
+    images = record.get('dynamodb', {})
+    old_item = {k: deserializer.deserialize(v) for k, v in images.get('OldImage', {}).items()}
+    new_item = {k: deserializer.deserialize(v) for k, v in images.get('NewImage', {}).items()}
+
+    deltas: Dict[str, Tuple[int, Dict]] = {}
+    for key, attributes in aggregate_contributions(new_item).items():
+        deltas[key] = (1, attributes)
+    for key, attributes in aggregate_contributions(old_item).items():
+        delta, existing = deltas.get(key, (0, attributes))
+        deltas[key] = (delta - 1, existing)
+
+    return {key: value for key, value in deltas.items() if value[0] != 0}
+
+def _aggregate_update(key: str, delta: int, attributes: Dict, now: int) -> Dict:
+    """Transaction item that adds `delta` to one aggregate"""
+    names = {'#count': 'count', '#updated_at': 'updated_at'}
+    values = {':delta': delta, ':now': now}
+    assignments = ['#updated_at = :now']
+    for name, value in attributes.items():
+        names[f'#{name}'] = name
+        values[f':{name}'] = value
+        assignments.append(f'#{name} = if_not_exists(#{name}, :{name})')
+
+    return {
+        'Update': {
+            'TableName': AGGREGATES_TABLE,
+            'Key': {'aggregate': serializer.serialize(key)},
+            'UpdateExpression': f"ADD #count :delta SET {', '.join(assignments)}",
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': {k: serializer.serialize(v) for k, v in values.items()}
+        }
+    }
+
+def _event_marker(event_id: str, now: int) -> Dict:
+    """Transaction item that fails if this stream record was already applied"""
+    return {
+        'Put': {
+            'TableName': AGGREGATES_TABLE,
+            'Item': {
+                'aggregate': serializer.serialize(f'event#{event_id}'),
+                'expires_at': serializer.serialize(now + EVENT_MARKER_TTL_SECONDS)
+            },
+            'ConditionExpression': 'attribute_not_exists(#aggregate)',
+            'ExpressionAttributeNames': {'#aggregate': 'aggregate'}
+        }
+    }
+
+def _apply(records: List[Dict]) -> bool:
+    """Apply a group of records in one transaction; False if any was a duplicate"""
+    now = int(time.time())
+    merged: Dict[str, List] = defaultdict(lambda: [0, {}])
+    for record in records:
+        for key, (delta, attributes) in record_deltas(record).items():
+            merged[key][0] += delta
+            merged[key][1] = attributes
+
+    items = [_event_marker(record['eventID'], now) for record in records]
+    items.extend(
+        _aggregate_update(key, delta, attributes, now)
+        for key, (delta, attributes) in merged.items() if delta != 0
+    )
+
+    for attempt in range(TRANSACTION_CONFLICT_RETRIES + 1):
+        try:
+            dynamodb_client.transact_write_items(TransactItems=items)
+            return True
+        except dynamodb_client.exceptions.TransactionCanceledException as e:
+            codes = {reason.get('Code') for reason in e.response.get('CancellationReasons', [])}
+            if 'ConditionalCheckFailed' in codes:
+                return False
+            if 'TransactionConflict' not in codes or attempt == TRANSACTION_CONFLICT_RETRIES:
+                raise
+            time.sleep(TRANSACTION_CONFLICT_BACKOFF_SECONDS * 2 ** attempt)
+
+def _chunk_records(records: List[Dict]) -> List[List[Dict]]:
+    """Split a shard batch into groups that fit in one transaction each"""
+    chunks, current, keys = [], [], set()
+    for record in records:
+        record_keys = set(record_deltas(record))
+        if current and len(current) + 1 + len(keys | record_keys) > MAX_TRANSACTION_ITEMS:
+            chunks.append(current)
+            current, keys = [], set()
+        current.append(record)
+        keys |= record_keys
+    if current:
+        chunks.append(current)
+    return chunks
+
+def process_records(records: List[Dict]) -> Dict:
+    """Fold a shard batch into the aggregate items exactly once
+
+    Stops at the first record that cannot be applied and returns its sequence
+    number as 'failed_sequence_number'; the stream resumes from there, and the
+    event markers skip any later records that had already been applied.
+    """
+    applied = duplicates = 0
+    for chunk in _chunk_records(records):
+        try:
+            if _apply(chunk):
+                applied += len(chunk)
+                continue
+        except Exception as e:
+            logger.warning(f"Failed to apply {len(chunk)} stream records, retrying one at a time: {e}")
+
+        # Part of the chunk was delivered before, or it failed; apply records one at a time
+        for record in chunk:
+            try:
+                if _apply([record]):
+                    applied += 1
+                else:
+                    duplicates += 1
+            except Exception as e:
+                logger.error(f"Failed to apply stream record {record.get('eventID')}: {e}")
+                return {
+                    'applied': applied,
+                    'duplicates': duplicates,
+                    'failed_sequence_number': record['dynamodb']['SequenceNumber']
+                }
+
+    return {'applied': applied, 'duplicates': duplicates, 'failed_sequence_number': None}
+
+def get_aggregate(key: str) -> Optional[Dict]:
+    """Read a single aggregate item, e.g. 'total', 'mood#reverent' or 'daily#2024-01-31'"""
+    return dynamodb.Table(AGGREGATES_TABLE).get_item(Key={'aggregate': key}).get('Item')
+
+def top_aggregates(kind: str, limit: int = 10) -> List[Dict]:
+    """Most counted aggregates of a kind ('mood', 'theme', 'labelset' or 'daily')"""
+    response = dynamodb.Table(AGGREGATES_TABLE).query(
+        IndexName='kind-count-index',
+        KeyConditionExpression='#kind = :kind',
+        ExpressionAttributeNames={'#kind': 'kind'},
+        ExpressionAttributeValues={':kind': kind},
+        ScanIndexForward=False,
+        Limit=limit
+    )
+    return response.get('Items', [])
+
+def lambda_handler(event, context):
+    """DynamoDB Streams handler maintaining precomputed metadata aggregates
+
+    Reports the first failed record as a batch item failure (the mapping uses
+    ReportBatchItemFailures), so retries resume there instead of at the start
+    of the batch.
+    """
+    records = event.get('Records', [])
+    result = process_records(records)
+    logger.info(f"Processed {len(records)} stream records: {result}")
+    failed = result['failed_sequence_number']
+    return {'batchItemFailures': [{'itemIdentifier': failed}] if failed else []}
@@ -0,0 +1,146 @@
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from enhanced_achamin_lambda import AudioProducer, EnhancedAchaminProcessor, metadata_table, negotiate_formats
+from metadata_aggregates import top_aggregates
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Parallelism is kept below the admission controller's per-container wait queue
+PRECOMPUTE_MAX_WORKERS = int(os.environ.get('PRECOMPUTE_MAX_WORKERS', '4'))
+
+# Accept strings the shipped frontend sends (getAudioAccept in enhanced-index.html):
+# browsers that play Ogg Opus and Vorbis, such as Chrome and Firefox, and those that
+# only play MP3, such as Safari
+FRONTEND_AUDIO_ACCEPTS = [
+    'audio/ogg; codecs=opus, audio/ogg, audio/mpeg;q=0.5',
+    'audio/mpeg;q=0.5'
+]
+
+# On-demand prices in USD, used to estimate what each item cost to generate
+BEDROCK_INPUT_PRICE_PER_1K_TOKENS = float(os.environ.get('BEDROCK_INPUT_PRICE_PER_1K_TOKENS', '0.0008'))
+BEDROCK_OUTPUT_PRICE_PER_1K_TOKENS = float(os.environ.get('BEDROCK_OUTPUT_PRICE_PER_1K_TOKENS', '0.0024'))
+POLLY_PRICE_PER_1M_CHARACTERS = {
+    'neural': float(os.environ.get('POLLY_NEURAL_PRICE_PER_1M_CHARACTERS', '16')),
+    'standard': float(os.environ.get('POLLY_STANDARD_PRICE_PER_1M_CHARACTERS', '4'))
+}
+
+def mine_label_sets(limit: int, max_scan_items: int = 5000) -> List[List[str]]:
+    """Most requested label sets, from the stream aggregates or a bounded metadata scan"""
+    try:
+        label_sets = [item['labels'] for item in top_aggregates('labelset', limit)]
+        if label_sets:
+            return label_sets
+    except Exception as e:
+        logger.warning(f"Error reading label set aggregates, scanning metadata: {e}")
+
+    counts = Counter()
+    scan_kwargs = {'ProjectionExpression': 'labels'}
+    scanned = 0
+    while scanned < max_scan_items:
+        response = metadata_table.scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            counts[tuple(sorted({label.lower() for label in item.get('labels', [])}))] += 1
+        scanned += response.get('ScannedCount', 0)
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    return [list(labels) for labels, _ in counts.most_common(limit) if labels]
+
+def _estimate_cost(prompt_chars: int, story_chars: int, narration_chars: int, engine: str) -> float:
+    """Rough generation cost in USD, assuming about four characters per token"""
+    bedrock_cost = (
+        prompt_chars / 4 / 1000 * BEDROCK_INPUT_PRICE_PER_1K_TOKENS
+        + story_chars / 4 / 1000 * BEDROCK_OUTPUT_PRICE_PER_1K_TOKENS
+    )
+    polly_cost = narration_chars / 1_000_000 * POLLY_PRICE_PER_1M_CHARACTERS.get(engine, 0)
+    return round(bedrock_cost + polly_cost, 6)
+
+def precompute_item(processor: EnhancedAchaminProcessor, labels: List[str],
+                    formats: List[Tuple[str, str]]) -> Dict:
+    """Populate the story, narration and mix caches for one label set"""
+    start = time.time()
+    try:
+        prepared = processor.prepare_experience(labels, formats)
+        story = prepared['story']
+        generated = sum(1 for status in prepared['renditions'].values() if status == 'generated')
+
+        return {
+            'labels': labels,
+            'style': prepared['style'],
+            'storyLength': prepared['story_length'],
+            'storyCached': prepared['cached'],
+            'renditions': prepared['renditions'],
+            'voiceId': prepared['voice_id'],
+            'seconds': round(time.time() - start, 3),
+            'estimatedCostUsd': _estimate_cost(
+                prepared['prompt_chars'],
+                0 if prepared['cached'] else len(story),
+                generated * len(story),
+                AudioProducer.engine_for_voice(prepared['voice_id'])
+            )
+        }
+    except Exception as e:
+        logger.error(f"Error precomputing {labels}: {e}")
+        return {'labels': labels, 'error': str(e), 'seconds': round(time.time() - start, 3)}
+
+def run_precompute(label_sets: List[List[str]], audio_accepts: Optional[List[str]] = None,
+                   max_workers: int = PRECOMPUTE_MAX_WORKERS) -> Dict:
+    """Precompute caches for each label set with bounded parallelism
+
+    Renditions are warmed for the formats each Accept string in `audio_accepts`
+    negotiates to, exactly as a request sending it would.
+    """
+    processor = EnhancedAchaminProcessor(story_cache=True)
+
+    # Label sets that normalize to the same cache entry would race each other
+    unique_label_sets = {}
+    for labels in label_sets:
+        unique_label_sets.setdefault(tuple(sorted({label.lower() for label in labels})), labels)
+    label_sets = list(unique_label_sets.values())
+
+    formats = list(dict.fromkeys(negotiate_formats(accept) for accept in audio_accepts or FRONTEND_AUDIO_ACCEPTS))
+    start = time.time()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        items = list(executor.map(
+            lambda labels: precompute_item(processor, labels, formats),
+            label_sets
+        ))
+
+    return {
+        'items': items,
+        'succeeded': sum(1 for item in items if 'error' not in item),
+        'failed': sum(1 for item in items if 'error' in item),
+        'estimatedCostUsd': round(sum(item.get('estimatedCostUsd', 0) for item in items), 6),
+        'seconds': round(time.time() - start, 3)
+    }
+
+def lambda_handler(event, context):
+    """Scheduled job that pre-generates stories and narration for popular subjects
+
+    Event fields:
+        label_sets: explicit list of label lists to precompute
+        mine_limit: when label_sets is absent, how many popular label sets to mine (default 20)
+        audio_accepts: Accept-style audio preferences to warm renditions for
+            (default FRONTEND_AUDIO_ACCEPTS, what the shipped frontend sends)
+        max_workers: parallelism (default PRECOMPUTE_MAX_WORKERS)
+    """
+    label_sets = event.get('label_sets') or mine_label_sets(int(event.get('mine_limit', 20)))
+    result = run_precompute(
+        label_sets,
+        audio_accepts=event.get('audio_accepts'),
+        max_workers=int(event.get('max_workers', PRECOMPUTE_MAX_WORKERS))
+    )
+    logger.info(
+        f"Precomputed {result['succeeded']} of {len(result['items'])} label sets in {result['seconds']}s, "
+        f"estimated cost ${result['estimatedCostUsd']}"
+    )
+    return result
@@ -0,0 +1,168 @@
+import cProfile
+import functools
+import json
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+import uuid
+from typing import Callable, Dict, List, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Profile every invocation, or every Nth invocation per container
+PROFILE_ENABLED = os.environ.get('PROFILE_ENABLED', 'false').lower() == 'true'
+PROFILE_SAMPLE_EVERY = int(os.environ.get('PROFILE_SAMPLE_EVERY', '0'))
+# s3://bucket/prefix or a local directory
+PROFILE_OUTPUT = os.environ.get('PROFILE_OUTPUT', '/tmp/achamin-profiles')
+PROFILE_TOP_N = int(os.environ.get('PROFILE_TOP_N', '25'))
+PROFILE_TRACE_FRAMES = int(os.environ.get('PROFILE_TRACE_FRAMES', '16'))
+
+# Allocations are attributed to the innermost frame in these handlers, so bytes
+# allocated inside base64 or boto3 are charged to the handler line that asked for them
+APP_SOURCE_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+_invocation_count = 0
+_active_profile: Optional[Dict] = None
+
+def should_profile() -> bool:
+    """Decide whether the current invocation is profiled"""
+    global _invocation_count
+    _invocation_count += 1
+    if PROFILE_ENABLED:
+        return True
+    return PROFILE_SAMPLE_EVERY > 0 and _invocation_count % PROFILE_SAMPLE_EVERY == 0
+
+def _allocation_sites(snapshot: tracemalloc.Snapshot) -> List[Dict]:
+    """Top allocation sites of a snapshot, largest first"""
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__)
+    ])
+    sites = []
+    for stat in snapshot.statistics('lineno')[:PROFILE_TOP_N]:
+        frame = stat.traceback[0]
+        sites.append({
+            'site': f'{frame.filename}:{frame.lineno}',
+            'sizeBytes': stat.size,
+            'count': stat.count
+        })
+    return sites
+
+def _app_allocation_sites(snapshot: tracemalloc.Snapshot) -> List[Dict]:
+    """Top allocation sites charged to the innermost handler frame, largest first"""
+    totals: Dict[str, List[int]] = {}
+    for trace in snapshot.traces:
+        # Frames run from oldest to most recent
+        for frame in reversed(trace.traceback):
+            if frame.filename.startswith(APP_SOURCE_DIR) and frame.filename != __file__:
+                site = totals.setdefault(f'{frame.filename}:{frame.lineno}', [0, 0])
+                site[0] += trace.size
+                site[1] += 1
+                break
+
+    ranked = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)
+    return [
+        {'site': site, 'sizeBytes': size, 'count': count}
+        for site, (size, count) in ranked[:PROFILE_TOP_N]
+    ]
+
+def checkpoint(label: str):
+    """Record live allocations at a point of interest; a no-op unless profiling
+
+    Buffers such as decoded images and audio are freed before the handler
+    returns, so the handlers call this while those buffers are still alive.
+    """
+    if _active_profile is None:
+        return
+    # Keep snapshot cost out of the CPU profile
+    profiler = _active_profile['profiler']
+    profiler.disable()
+    try:
+        current, peak = tracemalloc.get_traced_memory()
+        _active_profile['checkpoints'].append({
+            'label': label,
+            'elapsedMs': int((time.time() - _active_profile['start']) * 1000),
+            'currentBytes': current,
+            'peakBytes': peak,
+            'appAllocations': _app_allocation_sites(tracemalloc.take_snapshot())
+        })
+    finally:
+        profiler.enable()
+
+def _cpu_hotspots(profiler: cProfile.Profile) -> List[Dict]:
+    """Top functions by cumulative time"""
+    stats = pstats.Stats(profiler)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+    hotspots = []
+    for (filename, lineno, function), (_, calls, total, cumulative, _) in rows[:PROFILE_TOP_N]:
+        hotspots.append({
+            'function': f'{filename}:{lineno}({function})',
+            'calls': calls,
+            'totalMs': round(total * 1000, 3),
+            'cumulativeMs': round(cumulative * 1000, 3)
+        })
+    return hotspots
+
+def _write_profile(profile: Dict, name: str) -> str:
+    """Write the profile artifact to S3 or a local directory and return its location"""
+    body = json.dumps(profile, indent=2)
+    if PROFILE_OUTPUT.startswith('s3://'):
+        import boto3
+        bucket, _, prefix = PROFILE_OUTPUT[len('s3://'):].partition('/')
+        key = f"{prefix.rstrip('/')}/{name}" if prefix else name
+        boto3.client('s3').put_object(Bucket=bucket, Key=key, Body=body, ContentType='application/json')
+        return f's3://{bucket}/{key}'
+
+    path = os.path.join(PROFILE_OUTPUT, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(body)
+    return path
+
+def profiled(handler: Callable) -> Callable:
+    """Wrap a Lambda handler with opt-in CPU profiling and allocation tracking"""
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global _active_profile
+        if not should_profile():
+            return handler(event, context)
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(PROFILE_TRACE_FRAMES)
+        tracemalloc.reset_peak()
+
+        profiler = cProfile.Profile()
+        _active_profile = {'start': time.time(), 'checkpoints': [], 'profiler': profiler}
+        profiler.enable()
+        try:
+            return handler(event, context)
+        finally:
+            profiler.disable()
+            session, _active_profile = _active_profile, None
+            try:
+                _, peak = tracemalloc.get_traced_memory()
+                request_id = getattr(context, 'aws_request_id', None) or str(uuid.uuid4())
+                profile = {
+                    'handler': f'{handler.__module__}.{handler.__name__}',
+                    'requestId': request_id,
+                    'durationMs': int((time.time() - session['start']) * 1000),
+                    'peakTracedBytes': peak,
+                    'cpu': _cpu_hotspots(profiler),
+                    'checkpoints': session['checkpoints'],
+                    'retainedAllocations': _allocation_sites(tracemalloc.take_snapshot())
+                }
+                location = _write_profile(profile, f'{handler.__module__}/{request_id}.json')
+                logger.info(f"Wrote profile to {location}")
+            except Exception as e:
+                logger.error(f"Error writing profile: {e}")
+            finally:
+                if started_tracing:
+                    tracemalloc.stop()
+
+    return wrapper